@@ -3,7 +3,6 @@
 from __future__ import annotations
 
 import dataclasses
-import itertools
 
 import numpy as np
 
@@ -53,7 +52,7 @@ class Contour(trace.Trace):
     def to_plotly(self):
         lattice_supercell = np.diag(self.supercell) @ self.lattice.vectors
         # swap a and b axes because that is the way plotly expects the data
-        data = np.tile(self.data, self.supercell).T
+        data = self._tile_data().T
         if self._is_contour():
             yield self._make_contour(lattice_supercell, data), self._options()
         elif self._is_heatmap():
@@ -61,6 +60,12 @@ class Contour(trace.Trace):
         else:
             yield self._make_quiver(lattice_supercell, data), self._options()
 
+    def _tile_data(self):
+        # plotly copies the data, so tiling only needs to copy for an actual supercell
+        if np.all(np.equal(self.supercell, 1)):
+            return self.data
+        return np.tile(self.data, self.supercell)
+
     def _is_contour(self):
         return self.data.ndim == 2 and self.isolevels
 
@@ -78,12 +83,13 @@ class Contour(trace.Trace):
     def _make_quiver(self, lattice, data):
         u = data[:, :, 0].flatten()
         v = data[:, :, 1].flatten()
-        meshes = [
+        mesh_b, mesh_a = (
             np.linspace(np.zeros(2), vector, num_points, endpoint=False)
             for vector, num_points in zip(reversed(lattice), data.shape)
             # remember that b and a axis are swapped
-        ]
-        x, y = np.array([sum(points) for points in itertools.product(*meshes)]).T
+        )
+        points = mesh_b[:, np.newaxis] + mesh_a[np.newaxis, :]
+        x, y = points.reshape(-1, 2).T
         fig = ff.create_quiver(x, y, u, v, scale=1)
         return fig.data[0]
 
@@ -108,15 +114,15 @@ class Contour(trace.Trace):
         line_mesh_a = self._make_mesh(lattice, data.shape[1], 0)
         line_mesh_b = self._make_mesh(lattice, data.shape[0], 1)
         x_in, y_in = (line_mesh_a[:, np.newaxis] + line_mesh_b[np.newaxis, :]).T
-        x_in = x_in.flatten()
-        y_in = y_in.flatten()
-        z_in = data.flatten()
-        x_out, y_out = np.meshgrid(
-            np.linspace(x_in.min(), x_in.max(), shape[0]),
-            np.linspace(y_in.min(), y_in.max(), shape[1]),
-        )
-        z_out = interpolate.griddata((x_in, y_in), z_in, (x_out, y_out), method="cubic")
-        return x_out[0], y_out[:, 0], z_out
+        x_in = x_in.ravel()
+        y_in = y_in.ravel()
+        z_in = data.ravel()
+        x_out = np.linspace(x_in.min(), x_in.max(), shape[0])
+        y_out = np.linspace(y_in.min(), y_in.max(), shape[1])
+        # griddata broadcasts the coordinates, so the full mesh is not needed
+        xi = (x_out[np.newaxis, :], y_out[:, np.newaxis])
+        z_out = interpolate.griddata((x_in, y_in), z_in, xi, method="cubic")
+        return x_out, y_out, z_out
 
     def _use_data_without_interpolation(self, lattice, data):
         x = self._make_mesh(lattice, data.shape[1], 0)
@@ -1,6 +1,5 @@
 # Copyright © VASP Software GmbH,
 # Licensed under the Apache License 2.0 (http://www.apache.org/licenses/LICENSE-2.0)
-import itertools
 import os
 import tempfile
 from dataclasses import dataclass
@@ -30,9 +29,9 @@ class _Arrow3d(NamedTuple):
 
     def to_serializable(self):
         return (
-            list(self.tail),
-            list(self.tip),
-            list(convert.to_rgb(self.color)),
+            np.asarray(self.tail).tolist(),
+            np.asarray(self.tip).tolist(),
+            convert.to_rgb(self.color).tolist(),
             self.radius,
         )
 
@@ -212,12 +211,11 @@ attribute is supplied with its corresponding grid scalar or ion arrow component.
         step = 0
         for _arrows in self.ion_arrows:
             _, transformation = trajectory[step].cell.standard_form()
-            arrows = _arrows.quantity[step]
             positions = trajectory[step].get_positions()
-            for arrow, tail in zip(itertools.cycle(arrows), positions):
-                tip = arrow + tail
-                arrow_3d = _rotate(
-                    _Arrow3d(tail, tip, color=_arrows.color, radius=_arrows.radius),
-                    transformation,
-                )
-                widget.shape.add_arrow(*(arrow_3d.to_serializable()))
+            # repeat the arrows cyclically for all atoms of the supercell
+            arrows = np.resize(_arrows.quantity[step], positions.shape)
+            tails = positions @ transformation.T
+            tips = (positions + arrows) @ transformation.T
+            color = convert.to_rgb(_arrows.color).tolist()
+            for tail, tip in zip(tails.tolist(), tips.tolist()):
+                widget.shape.add_arrow(tail, tip, color, _arrows.radius)
@@ -1,6 +1,7 @@
 # Copyright © VASP Software GmbH,
 # Licensed under the Apache License 2.0 (http://www.apache.org/licenses/LICENSE-2.0)
 import dataclasses
+import functools
 import warnings
 from typing import Union
 
@@ -13,14 +14,18 @@ from py4vasp._util import import_, select
 from py4vasp._util.slicing import plane
 from py4vasp.calculation import _base, _structure
 
-interpolate = import_.optional("scipy.interpolate")
-ndimage = import_.optional("scipy.ndimage")
+fft = import_.optional("scipy.fft")
 
 _STM_MODES = {
     "constant_height": ["constant_height", "ch", "height"],
     "constant_current": ["constant_current", "cc", "current"],
 }
+_MODE_ALIASES = {
+    alias: mode for mode, aliases in _STM_MODES.items() for alias in aliases
+}
 _SPINS = ("up", "down", "total")
+_SCAN_BLOCK_SIZE = 8
+"Number of grid cells along z that are interpolated at once in the STM scan."
 
 
 @dataclasses.dataclass
@@ -41,6 +46,14 @@ class STM_settings:
     interpolation_factor : int
         The interpolation factor for the z-direction in case of
         constant current mode. The default is 10.
+    interpolation_order : int
+        The order of the interpolation in the z-direction in case of constant
+        current mode. Use 1 for linear or 3 for cubic interpolation.
+        The default is 1.
+    vacuum_from_structure : bool
+        Start the constant current scan in the middle of the vacuum determined from
+        the atomic positions. If False, the minimum of the laterally averaged charge
+        density is used instead. The default is True.
     """
 
     sigma_z: float = 4.0
@@ -48,6 +61,8 @@ class STM_settings:
     truncate: float = 3.0
     enhancement_factor: float = 1000
     interpolation_factor: int = 10
+    interpolation_order: int = 1
+    vacuum_from_structure: bool = True
 
 
 class PartialCharge(_base.Refinery, _structure.Mixin):
@@ -112,6 +127,7 @@ class PartialCharge(_base.Refinery, _structure.Mixin):
         tip_height: float = 2.0,
         current: float = 1.0,
         supercell: Union[int, np.array] = 2,
+        stm_settings: STM_settings = None,
     ) -> Graph:
         """Generate STM image data from the partial charge density.
 
@@ -121,6 +137,8 @@ class PartialCharge(_base.Refinery, _structure.Mixin):
             The mode in which the STM is operated and the spin channel to be used.
             Possible modes are "constant_height"(default) and "constant_current".
             Possible spin selections are "total"(default), "up", and "down".
+            Multiple selections, e.g., "constant_height(up) constant_current(up)",
+            produce one image each and reuse the smoothed charge density.
         tip_height : float
             The height of the STM tip above the surface in Angstrom.
             The default is 2.0 Angstrom. Only used in "constant_height" mode.
@@ -129,23 +147,37 @@ class PartialCharge(_base.Refinery, _structure.Mixin):
             Only used in "constant_current" mode.
         supercell : int | np.array
             The supercell to be used for plotting the STM. The default is 2.
+        stm_settings : STM_settings
+            Settings for the smoothing and the scan of the STM. The defaults are
+            given by the stm_settings property.
 
         Returns
         -------
         Graph
             The STM image as a graph object. The title is the label of the Contour
-            object.
+            object. If multiple selections are passed, the graph contains one Contour
+            for each of them and has no title.
         """
-        _raise_error_if_vacuum_too_small(self._estimate_vacuum())
+        settings = stm_settings or self.stm_settings
+        vacuum = self._estimate_vacuum()
+        _raise_error_if_vacuum_too_small(vacuum)
+        _raise_error_if_tip_too_far_away(tip_height, vacuum)
+        _raise_error_if_interpolation_order_not_supported(settings.interpolation_order)
 
         tree = select.Tree.from_selection(selection)
-        for index, selection in enumerate(tree.selections()):
-            if index > 0:
-                message = "Selecting more than one STM is not implemented."
-                raise exception.NotImplemented(message)
-            contour = self._make_contour(selection, tip_height, current)
-        contour.supercell = self._parse_supercell(supercell)
-        return Graph(series=contour, title=contour.label)
+        # multiple selections share the smoothed charge of the same spin
+        smoothed_charges = {}
+        contours = [
+            self._make_contour(
+                selection, tip_height, current, settings, smoothed_charges
+            )
+            for selection in tree.selections()
+        ]
+        for contour in contours:
+            contour.supercell = self._parse_supercell(supercell)
+        if len(contours) == 1:
+            return Graph(series=contours[0], title=contours[0].label)
+        return Graph(series=contours)
 
     def _parse_supercell(self, supercell):
         if isinstance(supercell, int):
@@ -156,28 +188,33 @@ class PartialCharge(_base.Refinery, _structure.Mixin):
         The supercell is used to multiply the x and y directions of the lattice."""
         raise exception.IncorrectUsage(message)
 
-    def _make_contour(self, selection, tip_height, current):
-        self._raise_error_if_tip_too_far_away(tip_height)
+    def _make_contour(self, selection, tip_height, current, settings, smoothed_charges):
         mode = self._parse_mode(selection)
         spin = self._parse_spin(selection)
         self._raise_error_if_selection_not_understood(selection, mode, spin)
-        smoothed_charge = self._get_stm_data(spin)
         if mode == "constant_height" or mode is None:
-            return self._constant_height_stm(smoothed_charge, tip_height, spin)
+            smoothed_charge = smoothed_charges.get(spin)
+            return self._constant_height_stm(
+                tip_height, spin, settings, smoothed_charge
+            )
         current = current * 1e-09  # convert nA to A
-        return self._constant_current_stm(smoothed_charge, current, spin)
+        if spin not in smoothed_charges:
+            smoothed_charges[spin] = self._get_stm_data(spin, settings)
+        return self._constant_current_stm(
+            smoothed_charges[spin], current, spin, settings
+        )
 
     def _parse_mode(self, selection):
-        for mode, aliases in _STM_MODES.items():
-            for alias in aliases:
-                if select.contains(selection, alias, ignore_case=True):
-                    return mode
+        for part in selection:
+            mode = _MODE_ALIASES.get(str(part).lower())
+            if mode is not None:
+                return mode
         return None
 
     def _parse_spin(self, selection):
-        for spin in _SPINS:
-            if select.contains(selection, spin, ignore_case=True):
-                return spin
+        for part in selection:
+            if str(part).lower() in _SPINS:
+                return str(part).lower()
         return None
 
     def _raise_error_if_selection_not_understood(self, selection, mode, spin):
@@ -185,94 +222,120 @@ class PartialCharge(_base.Refinery, _structure.Mixin):
             message = f"STM mode '{selection}' was parsed as mode='{mode}' and spin='{spin}' which could not be used. Please use 'constant_height' or 'constant_current' as mode and 'up', 'down', or 'total' as spin."
             raise exception.IncorrectUsage(message)
 
-    def _constant_current_stm(self, smoothed_charge, current, spin):
-        z_start = _min_of_z_charge(
-            self._get_stm_data(spin),
-            sigma=self.stm_settings.sigma_z,
-            truncate=self.stm_settings.truncate,
-        )
-        grid = self.grid()
-        z_step = 1 / self.stm_settings.interpolation_factor
+    def _constant_current_stm(self, smoothed_charge, current, spin, settings):
+        z_start = self._z_index_in_vacuum(smoothed_charge, settings)
+        num_z = smoothed_charge.shape[2]
+        interpolation_factor = settings.interpolation_factor
+        interpolation_order = settings.interpolation_order
+        z_step = 1 / interpolation_factor
         # roll smoothed charge so that we are not bothered by the boundary of the
         # unit cell if the slab is not centered. z_start is now the first index
         smoothed_charge = np.roll(smoothed_charge, -z_start, axis=2)
-        z_grid = np.arange(grid[2], 0, -z_step)
-        splines = interpolate.CubicSpline(range(grid[2]), smoothed_charge, axis=-1)
-        scan = z_grid[np.argmax(splines(z_grid) >= current, axis=-1)]
+        z_grid = num_z - z_step * np.arange(num_z * interpolation_factor)
+        index = _first_index_above(
+            smoothed_charge, current, interpolation_factor, interpolation_order
+        )
+        scan = z_grid[index]
         scan = z_step * (scan - scan.min())
         spin_label = "both spin channels" if spin == "total" else f"spin {spin}"
         topology = self._topology()
         label = f"STM of {topology} for {spin_label} at constant current={current*1e9:.2f} nA"
         return Contour(data=scan, lattice=self._get_stm_plane(), label=label)
 
-    def _constant_height_stm(self, smoothed_charge, tip_height, spin):
-        zz = self._z_index_for_height(tip_height + self._get_highest_z_coord())
-        height_scan = smoothed_charge[:, :, zz] * self.stm_settings.enhancement_factor
+    def _constant_height_stm(self, tip_height, spin, settings, smoothed_charge=None):
+        _, highest_z_coord = self._get_z_range()
+        zz = self._z_index_for_height(tip_height + highest_z_coord)
+        if smoothed_charge is None:
+            height_scan = self._smooth_stm_slice(
+                self._get_raw_stm_data(spin), zz, settings
+            )
+        else:
+            height_scan = smoothed_charge[:, :, zz]
+        height_scan = height_scan * settings.enhancement_factor
         spin_label = "both spin channels" if spin == "total" else f"spin {spin}"
         topology = self._topology()
         label = f"STM of {topology} for {spin_label} at constant height={float(tip_height):.2f} Angstrom"
         return Contour(data=height_scan, lattice=self._get_stm_plane(), label=label)
 
+    def _z_index_in_vacuum(self, smoothed_charge, settings):
+        """Return a z-index in the middle of the vacuum region."""
+        if not settings.vacuum_from_structure:
+            return _min_of_z_charge(smoothed_charge)
+        lowest_z_coord, highest_z_coord = self._get_z_range()
+        # the vacuum extends from the top of the slab to its periodic image
+        bottom_of_image = lowest_z_coord + self._out_of_plane_vector()
+        return self._z_index_for_height(0.5 * (highest_z_coord + bottom_of_image))
+
     def _z_index_for_height(self, tip_height):
         """Return the z-index of the tip height in the charge density grid."""
         # In case the surface is very up in the unit cell, we have to wrap around
-        return round(
-            np.mod(
-                tip_height / self._out_of_plane_vector() * self.grid()[2],
-                self.grid()[2],
-            )
-        )
+        num_z = self.grid()[2]
+        return round(tip_height / self._out_of_plane_vector() * num_z) % num_z
 
     def _height_from_z_index(self, z_index):
         """Return the height of the z-index in the charge density grid."""
         return z_index * self._out_of_plane_vector() / self.grid()[2]
 
-    def _get_highest_z_coord(self):
-        cart_coords = _get_sanitized_cartesian_positions(self._structure)
-        return np.max(cart_coords[:, 2])
-
-    def _get_lowest_z_coord(self):
-        cart_coords = _get_sanitized_cartesian_positions(self._structure)
-        return np.min(cart_coords[:, 2])
+    def _get_z_range(self):
+        """Return the lowest and highest z coordinate of all atoms."""
+        z_coords = _get_sanitized_cartesian_positions(self._structure)[:, 2]
+        return np.min(z_coords), np.max(z_coords)
 
     def _topology(self):
         return str(self._structure._topology())
 
     def _estimate_vacuum(self):
         _raise_error_if_vacuum_not_along_z(self._structure)
-        slab_thickness = self._get_highest_z_coord() - self._get_lowest_z_coord()
+        lowest_z_coord, highest_z_coord = self._get_z_range()
+        slab_thickness = highest_z_coord - lowest_z_coord
         return self._out_of_plane_vector() - slab_thickness
 
-    def _raise_error_if_tip_too_far_away(self, tip_height):
-        if tip_height > self._estimate_vacuum() / 2:
-            message = f"""The tip position at {tip_height:.2f} is above half of the
-             estimated vacuum thickness {self._estimate_vacuum():.2f} Angstrom.
-            You would be sampling the bottom of your slab, which is not supported."""
-            raise exception.IncorrectUsage(message)
+    def _get_stm_data(self, spin, settings):
+        charge_data = self._read_stm_charge(spin)
+        # the unit conversion is applied by the filter instead of a separate pass
+        scale = self._unit_scale(charge_data)
+        return self._smooth_stm_data(charge_data, settings, scale)
 
-    def _get_stm_data(self, spin):
+    def _get_raw_stm_data(self, spin):
+        return self._correct_units(self._read_stm_charge(spin))
+
+    def _read_stm_charge(self, spin):
         if 0 not in self.bands() or 0 not in self.kpoints():
             massage = """Simulated STM images are only supported for non-separated bands and k-points.
             Please set LSEPK and LSEPB to .FALSE. in the INCAR file."""
             raise exception.NotImplemented(massage)
-        chg = self._correct_units(self.to_numpy(spin, band=0, kpoint=0))
-        return self._smooth_stm_data(chg)
+        return self.to_numpy(spin, band=0, kpoint=0)
 
     def _correct_units(self, charge_data):
-        grid_volume = np.prod(self.grid())
+        # the STM data is processed in single precision to save memory bandwidth;
+        # casting and scaling in one operation avoids an extra pass over the grid
+        return np.multiply(charge_data, self._unit_scale(charge_data), dtype=np.float32)
+
+    def _unit_scale(self, charge_data):
+        # the charge is given on the full grid, so its size is the number of points
+        grid_volume = charge_data.size
         cell_volume = self._structure.volume()
-        return charge_data / (grid_volume * cell_volume)
+        return 1 / (grid_volume * cell_volume)
 
-    def _smooth_stm_data(self, data):
-        sigma = (
-            self.stm_settings.sigma_xy,
-            self.stm_settings.sigma_xy,
-            self.stm_settings.sigma_z,
-        )
-        return ndimage.gaussian_filter(
-            data, sigma=sigma, truncate=self.stm_settings.truncate, mode="wrap"
+    def _smooth_stm_data(self, data, settings, scale=1.0):
+        sigmas = (settings.sigma_xy, settings.sigma_xy, settings.sigma_z)
+        return _gaussian_filter_fft(
+            data, sigmas, settings.truncate, scale, dtype=np.float32
         )
 
+    def _smooth_stm_slice(self, data, z_index, settings):
+        """Return the smoothed data in the xy plane at the given z index.
+
+        Only the grid points along z within the range of the Gaussian kernel contribute
+        to the plane, so the rest of the volume does not need to be smoothed."""
+        kernel = _gaussian_kernel(settings.sigma_z, settings.truncate)
+        radius = len(kernel) // 2
+        z_window = range(z_index - radius, z_index + radius + 1)
+        window = np.take(data, z_window, axis=2, mode="wrap")
+        smoothed = window @ kernel.astype(data.dtype)
+        sigmas = (settings.sigma_xy, settings.sigma_xy)
+        return _gaussian_filter_fft(smoothed, sigmas, settings.truncate)
+
     def _get_stm_plane(self):
         """Return lattice plane spanned by a and b vectors"""
         return plane(
@@ -313,13 +376,17 @@ class PartialCharge(_base.Refinery, _structure.Mixin):
         band = self._check_band_index(band)
         kpoint = self._check_kpoint_index(kpoint)
 
-        parchg = self._raw_data.partial_charge[:].T
+        # index before transposing so that only the selected data is read
+        parchg = self._raw_data.partial_charge
         if not self._spin_polarized() or selection == "total":
-            return parchg[:, :, :, 0, band, kpoint]
-        if selection == "up":
-            return parchg[:, :, :, :, band, kpoint] @ np.array([0.5, 0.5])
-        if selection == "down":
-            return parchg[:, :, :, :, band, kpoint] @ np.array([0.5, -0.5])
+            return parchg[kpoint, band, 0].T
+        if selection in ("up", "down"):
+            total, magnetization = parchg[kpoint, band]
+            combine = np.add if selection == "up" else np.subtract
+            # the combined array is new, so it can be scaled in place
+            result = combine(total, magnetization)
+            result *= 0.5
+            return result.T
 
         message = f"Spin '{selection}' not understood. Use 'up', 'down' or 'total'."
         raise exception.IncorrectUsage(message)
@@ -381,12 +448,29 @@ def _raise_error_if_vacuum_too_small(vacuum_thickness, min_vacuum=5.0):
         raise exception.IncorrectUsage(message)
 
 
+def _raise_error_if_tip_too_far_away(tip_height, vacuum_thickness):
+    """Raise an error if the tip would sample the bottom of the periodic slab."""
+
+    if tip_height > vacuum_thickness / 2:
+        message = f"""The tip position at {tip_height:.2f} is above half of the
+             estimated vacuum thickness {vacuum_thickness:.2f} Angstrom.
+            You would be sampling the bottom of your slab, which is not supported."""
+        raise exception.IncorrectUsage(message)
+
+
+def _raise_error_if_interpolation_order_not_supported(interpolation_order):
+    """Raise an error if the charge cannot be interpolated with the given order."""
+
+    if interpolation_order not in (1, 3):
+        message = f"""The interpolation order {interpolation_order} is not supported.
+            Please use 1 for linear or 3 for cubic interpolation."""
+        raise exception.IncorrectUsage(message)
+
+
 def _raise_error_if_vacuum_not_along_z(structure):
     """Raise an error if the vacuum region is not along the z-direction."""
     frac_pos = _get_sanitized_fractional_positions(structure)
-    delta_x = np.max(frac_pos[:, 0]) - np.min(frac_pos[:, 0])
-    delta_y = np.max(frac_pos[:, 1]) - np.min(frac_pos[:, 1])
-    delta_z = np.max(frac_pos[:, 2]) - np.min(frac_pos[:, 2])
+    delta_x, delta_y, delta_z = np.ptp(frac_pos, axis=0)
 
     if delta_z > delta_x or delta_z > delta_y:
         message = """The vacuum region in your cell is not located along
@@ -414,13 +498,132 @@ def _get_sanitized_cartesian_positions(structure):
     return np.dot(frac_pos, structure.lattice_vectors())
 
 
-def _min_of_z_charge(charge, sigma=4, truncate=3.0):
-    """Returns the z-coordinate of the minimum of the charge density in the z-direction"""
+@functools.lru_cache
+def _gaussian_kernel(sigma, truncate):
+    """Return the normalized Gaussian kernel truncated like the ndimage filters."""
+    if sigma < 1e-15:
+        # like ndimage, a vanishing width leaves the data unchanged
+        kernel = np.ones(1)
+    else:
+        radius = int(truncate * sigma + 0.5)
+        kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+        kernel /= kernel.sum()
+    kernel.flags.writeable = False
+    return kernel
+
+
+def _gaussian_filter_fft(data, sigmas, truncate, scale=1.0, dtype=None):
+    """Apply a periodic Gaussian filter along all axes and multiply it by scale."""
+    # double precision avoids FFT noise in the low density vacuum region
+    transform = fft.rfftn(data.astype(np.float64, copy=False), workers=-1)
+    last_axis = data.ndim - 1
+    for axis, (sigma, size) in enumerate(zip(sigmas, data.shape)):
+        response = _gaussian_response(sigma, truncate, size, axis == last_axis)
+        if axis == 0:
+            response = scale * response
+        shape = [1] * data.ndim
+        shape[axis] = response.size
+        transform *= response.reshape(shape)
+    result = fft.irfftn(transform, s=data.shape, overwrite_x=True, workers=-1)
+    return result.astype(dtype or data.dtype, copy=False)
+
+
+@functools.lru_cache
+def _gaussian_response(sigma, truncate, size, real_transform):
+    """Return the real Fourier transform of the Gaussian kernel on a periodic grid."""
+    kernel = _gaussian_kernel(sigma, truncate)
+    radius = len(kernel) // 2
+    periodic_kernel = np.zeros(size)
+    np.add.at(periodic_kernel, np.arange(-radius, radius + 1) % size, kernel)
+    transform = fft.rfft if real_transform else fft.fft
+    response = transform(periodic_kernel).real.copy()
+    response.flags.writeable = False
+    return response
+
+
+def _first_index_above(charge, threshold, interpolation_factor, interpolation_order):
+    """Return the first interpolated z sample from the top above the threshold or 0."""
+    table = _interpolation_table(interpolation_factor, interpolation_order)
+    num_cells = charge.shape[-1]
+    # nodes contain the values and for cubic interpolation the derivatives
+    nodes = charge.reshape(-1, num_cells, 1)
+    if interpolation_order == 3:
+        derivatives = 0.5 * (np.roll(nodes, -1, axis=1) - np.roll(nodes, 1, axis=1))
+        nodes = np.concatenate((nodes, derivatives), axis=-1)
+    result = np.zeros(len(nodes), dtype=np.intp)
+    remaining = np.arange(len(nodes))
+    # only blocks of cells, whose upper bound reaches the threshold, are sampled;
+    # the cells are counted from the top, i.e., reversed compared to the nodes
+    candidates = _upper_bound_of_cells(nodes)[:, ::-1] >= threshold
+    cell_indices = np.arange(num_cells)
+    block = np.arange(_SCAN_BLOCK_SIZE)
+    while True:
+        has_candidate = np.any(candidates, axis=1)
+        remaining = remaining[has_candidate]
+        if remaining.size == 0:
+            break
+        nodes = nodes[has_candidate]
+        candidates = candidates[has_candidate]
+        first_cell = np.argmax(candidates, axis=1)
+        cells = first_cell[:, np.newaxis] + block
+        lower = np.maximum(num_cells - 1 - cells, 0)
+        upper = (lower + 1) % num_cells
+        columns = np.arange(len(nodes))[:, np.newaxis]
+        coefficients = np.concatenate(
+            (nodes[columns, lower], nodes[columns, upper]), axis=-1
+        )
+        samples = coefficients @ table.T
+        samples[cells >= num_cells] = -np.inf
+        samples = samples.reshape(len(nodes), -1)
+        # only compare the columns, which reach the threshold, sample by sample
+        found = np.max(samples, axis=1) >= threshold
+        first_above = np.argmax(samples[found] >= threshold, axis=1)
+        result[remaining[found]] = (
+            first_cell[found] * interpolation_factor + first_above
+        )
+        # continue with the next candidate below the block for the other columns
+        candidates[cell_indices <= cells[:, -1:]] = False
+        candidates[found] = False
+    return result.reshape(charge.shape[:-1])
+
+
+def _upper_bound_of_cells(nodes):
+    """Return an upper bound of the interpolation within every cell along z."""
+    values = nodes[..., 0]
+    next_values = np.roll(values, -1, axis=1)
+    bound = np.maximum(values, next_values)
+    if nodes.shape[-1] == 1:
+        return bound
+    # the cubic Hermite polynomial is bounded by its Bezier control points
+    derivatives = nodes[..., 1]
+    next_derivatives = np.roll(derivatives, -1, axis=1)
+    bound = np.maximum(bound, values + derivatives / 3)
+    return np.maximum(bound, next_values - next_derivatives / 3)
+
+
+def _interpolation_table(interpolation_factor, interpolation_order):
+    """Return the weights of the nodes at both ends of a cell for the samples in it."""
+    # samples are ordered from the top of the cell downwards
+    t = 1 - np.arange(interpolation_factor, dtype=np.float32) / interpolation_factor
+    if interpolation_order == 1:
+        return np.stack((1 - t, t), axis=-1)
+    return np.stack(
+        (
+            2 * t**3 - 3 * t**2 + 1,
+            t**3 - 2 * t**2 + t,
+            -2 * t**3 + 3 * t**2,
+            t**3 - t**2,
+        ),
+        axis=-1,
+    )
+
+
+def _min_of_z_charge(charge):
+    """Returns the z-coordinate of the minimum of the charge density in the z-direction
+
+    The charge is expected to be smoothed already along all directions, so neither
+    the 3d filter nor an additional filter of the average along z is needed."""
     # average over the x and y axis
     z_charge = np.mean(charge, axis=(0, 1))
-    # smooth the data using a gaussian filter
-    z_charge = ndimage.gaussian_filter1d(
-        z_charge, sigma=sigma, truncate=truncate, mode="wrap"
-    )
     # return the z-coordinate of the minimum
     return np.argmin(z_charge)
@@ -9,7 +9,7 @@ import pytest
 from py4vasp import calculation, exception
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def single_band(raw_data):
     raw_band = raw_data.band("single")
     band = calculation.band.from_data(raw_band)
@@ -19,13 +19,12 @@ def single_band(raw_data):
     band.ref.occupations = raw_band.occupations[0]
     raw_kpoints = raw_band.dispersion.kpoints
     band.ref.kpoints = calculation.kpoint.from_data(raw_kpoints)
-    formatter = {"float": lambda x: f"{x:.2f}"}
-    kpoint_to_string = lambda vec: np.array2string(vec, formatter=formatter) + " 1"
-    band.ref.index = [kpoint_to_string(kpoint) for kpoint in raw_kpoints.coordinates]
+    coordinates = raw_kpoints.coordinates
+    band.ref.index = [f"[{x:.2f} {y:.2f} {z:.2f}] 1" for x, y, z in coordinates]
     return band
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def multiple_bands(raw_data):
     raw_band = raw_data.band("multiple")
     band = calculation.band.from_data(raw_band)
@@ -36,7 +35,7 @@ def multiple_bands(raw_data):
     return band
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def with_projectors(raw_data):
     raw_band = raw_data.band("multiple with_projectors")
     band = calculation.band.from_data(raw_band)
@@ -47,7 +46,7 @@ def with_projectors(raw_data):
     return band
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def line_no_labels(raw_data):
     raw_band = raw_data.band("line no_labels")
     band = calculation.band.from_data(raw_band)
@@ -56,7 +55,7 @@ def line_no_labels(raw_data):
     return band
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def line_with_labels(raw_data):
     raw_band = raw_data.band("line with_labels")
     band = calculation.band.from_data(raw_band)
@@ -65,7 +64,7 @@ def line_with_labels(raw_data):
     return band
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def spin_polarized(raw_data):
     raw_band = raw_data.band("spin_polarized")
     band = calculation.band.from_data(raw_band)
@@ -78,19 +77,21 @@ def spin_polarized(raw_data):
     return band
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def spin_projectors(raw_data):
     raw_band = raw_data.band("spin_polarized with_projectors")
     band = calculation.band.from_data(raw_band)
     band.ref = types.SimpleNamespace()
     band.ref.bands_up = raw_band.dispersion.eigenvalues[0]
     band.ref.bands_down = raw_band.dispersion.eigenvalues[1]
-    band.ref.s_up = np.sum(raw_band.projections[0, :, 0, :, :], axis=0)
-    band.ref.s_down = np.sum(raw_band.projections[1, :, 0, :, :], axis=0)
-    band.ref.Fe_d_up = np.sum(raw_band.projections[0, 0:3, 2, :, :], axis=0)
-    band.ref.Fe_d_down = np.sum(raw_band.projections[1, 0:3, 2, :, :], axis=0)
-    band.ref.O_up = np.sum(raw_band.projections[0, 3:7, :, :, :], axis=(0, 1))
-    band.ref.O_down = np.sum(raw_band.projections[1, 3:7, :, :, :], axis=(0, 1))
+    # reduce both spin components of every selection at once
+    projections = raw_band.projections
+    s = np.sum(projections[:, :, 0, :, :], axis=1)
+    Fe_d = np.sum(projections[:, 0:3, 2, :, :], axis=1)
+    O = np.sum(projections[:, 3:7, :, :, :], axis=(1, 2))
+    band.ref.s_up, band.ref.s_down = s
+    band.ref.Fe_d_up, band.ref.Fe_d_down = Fe_d
+    band.ref.O_up, band.ref.O_down = O
     projector = calculation.projector.from_data(raw_band.projectors)
     band.ref.projectors_string = str(projector)
     return band
@@ -173,31 +174,31 @@ def test_multiple_bands_to_frame(multiple_bands, Assert, not_core):
     assert actual.index[1] == "2"
     assert actual.index[2] == "3"
     assert actual.index[3] == "[0.00 0.00 0.38] 1"
-    Assert.allclose(actual.bands, multiple_bands.ref.bands.T.flatten())
-    Assert.allclose(actual.occupations, multiple_bands.ref.occupations.T.flatten())
+    Assert.allclose(actual.bands, multiple_bands.ref.bands.ravel(order="F"))
+    Assert.allclose(actual.occupations, multiple_bands.ref.occupations.ravel(order="F"))
 
 
 def test_with_projectors_to_frame(with_projectors, Assert, not_core):
     actual = with_projectors.to_frame("Sr p")
-    Assert.allclose(actual.Sr, with_projectors.ref.Sr.T.flatten())
-    Assert.allclose(actual.p, with_projectors.ref.p.T.flatten())
+    Assert.allclose(actual.Sr, with_projectors.ref.Sr.ravel(order="F"))
+    Assert.allclose(actual.p, with_projectors.ref.p.ravel(order="F"))
 
 
 def test_spin_polarized_to_frame(spin_polarized, Assert, not_core):
     actual = spin_polarized.to_frame()
     ref = spin_polarized.ref
-    Assert.allclose(actual.bands_up, ref.bands_up.T.flatten())
-    Assert.allclose(actual.bands_down, ref.bands_down.T.flatten())
-    Assert.allclose(actual.occupations_up, ref.occupations_up.T.flatten())
-    Assert.allclose(actual.occupations_down, ref.occupations_down.T.flatten())
+    Assert.allclose(actual.bands_up, ref.bands_up.ravel(order="F"))
+    Assert.allclose(actual.bands_down, ref.bands_down.ravel(order="F"))
+    Assert.allclose(actual.occupations_up, ref.occupations_up.ravel(order="F"))
+    Assert.allclose(actual.occupations_down, ref.occupations_down.ravel(order="F"))
 
 
 def test_spin_projectors_to_frame(spin_projectors, Assert, not_core):
     actual = spin_projectors.to_frame(selection="O Fe(d)")
-    Assert.allclose(actual.O_up, spin_projectors.ref.O_up.T.flatten())
-    Assert.allclose(actual.O_down, spin_projectors.ref.O_down.T.flatten())
-    Assert.allclose(actual.Fe_d_up, spin_projectors.ref.Fe_d_up.T.flatten())
-    Assert.allclose(actual.Fe_d_down, spin_projectors.ref.Fe_d_down.T.flatten())
+    Assert.allclose(actual.O_up, spin_projectors.ref.O_up.ravel(order="F"))
+    Assert.allclose(actual.O_down, spin_projectors.ref.O_down.ravel(order="F"))
+    Assert.allclose(actual.Fe_d_up, spin_projectors.ref.Fe_d_up.ravel(order="F"))
+    Assert.allclose(actual.Fe_d_down, spin_projectors.ref.Fe_d_down.ravel(order="F"))
 
 
 def test_single_band_plot(single_band, Assert):
@@ -316,33 +317,15 @@ def check_to_image(single_band, filename_argument, expected_filename):
         fig.write_image.assert_called_once_with(single_band._path / expected_filename)
 
 
-def test_multiple_bands_print(multiple_bands, format_):
-    actual, _ = format_(multiple_bands)
+@pytest.mark.parametrize(
+    "band, num_kpoints",
+    [("multiple_bands", 48), ("line_no_labels", 20), ("line_with_labels", 20)],
+)
+def test_print(band, num_kpoints, format_, request):
+    actual, _ = format_(request.getfixturevalue(band))
     reference = f"""
 band data:
-    48 k-points
-    3 bands
-no projectors
-    """.strip()
-    assert actual == {"text/plain": reference}
-
-
-def test_line_no_labels_print(line_no_labels, format_):
-    actual, _ = format_(line_no_labels)
-    reference = f"""
-band data:
-    20 k-points
-    3 bands
-no projectors
-    """.strip()
-    assert actual == {"text/plain": reference}
-
-
-def test_line_with_labels_print(line_with_labels, format_):
-    actual, _ = format_(line_with_labels)
-    reference = f"""
-band data:
-    20 k-points
+    {num_kpoints} k-points
     3 bands
 no projectors
     """.strip()
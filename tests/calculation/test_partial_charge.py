@@ -2,14 +2,20 @@
 # Licensed under the Apache License 2.0 (http://www.apache.org/licenses/LICENSE-2.0)
 import dataclasses
 import types
+from unittest.mock import patch
 
 import numpy as np
 import pytest
 
 from py4vasp import calculation
+from py4vasp._util import import_, select
 from py4vasp._util.slicing import plane
+from py4vasp.calculation import _partial_charge
 from py4vasp.exception import IncorrectUsage, NoData, NotImplemented
 
+interpolate = import_.optional("scipy.interpolate")
+ndimage = import_.optional("scipy.ndimage")
+
 
 @pytest.fixture(
     params=[
@@ -228,6 +234,20 @@ def test_to_stm_wrong_mode(PolarizedNonSplitPartialCharge):
     assert "STM mode" in str(excinfo.value)
 
 
+@pytest.mark.parametrize(
+    "selection, mode, spin",
+    (
+        ("CC(Up)", "constant_current", "up"),
+        ("Height", "constant_height", None),
+        ("TOTAL", None, "total"),
+    ),
+)
+def test_parse_stm_selection(NonSplitPartialCharge, selection, mode, spin):
+    selection = next(select.Tree.from_selection(selection).selections())
+    assert NonSplitPartialCharge._parse_mode(selection) == mode
+    assert NonSplitPartialCharge._parse_spin(selection) == spin
+
+
 def test_wrong_vacuum_direction(NonSplitPartialChargeNi_100):
     msg = """The vacuum region in your cell is not located along
         the third lattice vector."""
@@ -311,6 +331,204 @@ def test_to_stm_nonsplit_constant_current_non_ortho(
     assert f"{current:.2f}" in actual.title
 
 
+def test_to_stm_constant_current_smooths_once(PolarizedNonSplitPartialCharge, not_core):
+    smooth = PolarizedNonSplitPartialCharge._smooth_stm_data
+    with patch.object(
+        PolarizedNonSplitPartialCharge, "_smooth_stm_data", wraps=smooth
+    ) as mock_smooth:
+        PolarizedNonSplitPartialCharge.to_stm("constant_current", current=5)
+    mock_smooth.assert_called_once()
+
+
+@pytest.mark.parametrize("interpolation_order", (1, 3))
+def test_to_stm_interpolation_order(
+    PolarizedNonSplitPartialCharge, interpolation_order, not_core
+):
+    settings = _partial_charge.STM_settings(interpolation_order=interpolation_order)
+    first_index_above = _partial_charge._first_index_above
+    with patch.object(
+        _partial_charge, "_first_index_above", wraps=first_index_above
+    ) as mock_scan:
+        PolarizedNonSplitPartialCharge.to_stm("cc", stm_settings=settings)
+    mock_scan.assert_called_once()
+    assert mock_scan.call_args.args[3] == interpolation_order
+
+
+def test_stm_data_single_precision(PolarizedNonSplitPartialCharge, spin, not_core):
+    settings = PolarizedNonSplitPartialCharge.stm_settings
+    actual = PolarizedNonSplitPartialCharge._get_stm_data(spin, settings)
+    assert actual.dtype == np.float32
+    raw_data = PolarizedNonSplitPartialCharge._get_raw_stm_data(spin)
+    expected = PolarizedNonSplitPartialCharge._smooth_stm_data(raw_data, settings)
+    # normalize because the scaled charge is of the order of the default tolerance
+    norm = np.abs(expected).max()
+    assert np.allclose(actual / norm, expected / norm, rtol=1e-5, atol=1e-6)
+
+
+def test_to_stm_multiple_selections(PolarizedNonSplitPartialCharge, Assert, not_core):
+    smooth = PolarizedNonSplitPartialCharge._smooth_stm_data
+    selection = "constant_current(up) constant_current(down) constant_height(up)"
+    with patch.object(
+        PolarizedNonSplitPartialCharge, "_smooth_stm_data", wraps=smooth
+    ) as mock_smooth:
+        actual = PolarizedNonSplitPartialCharge.to_stm(selection, supercell=3)
+    assert mock_smooth.call_count == 2
+    assert len(actual) == 3
+    assert "constant current" in actual[0].label
+    assert "spin up" in actual[0].label
+    assert "spin down" in actual[1].label
+    assert "constant height" in actual[2].label
+    single = PolarizedNonSplitPartialCharge.to_stm("constant_height(up)")
+    Assert.allclose(actual[2].data, single.series.data)
+    for contour in actual:
+        Assert.allclose(contour.supercell, np.asarray([3, 3]))
+
+
+def test_smooth_stm_data(NonSplitPartialCharge, not_core):
+    settings = NonSplitPartialCharge.stm_settings
+    data = NonSplitPartialCharge.to_numpy().astype(np.float32)
+    actual = NonSplitPartialCharge._smooth_stm_data(data, settings)
+    sigma = (settings.sigma_xy, settings.sigma_xy, settings.sigma_z)
+    expected = ndimage.gaussian_filter(
+        data, sigma=sigma, truncate=settings.truncate, mode="wrap"
+    )
+    assert actual.dtype == np.float32
+    assert np.allclose(actual, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("sigmas", ((1.0, 2.0, 0.5), (4.0, 4.0, 3.0)))
+def test_gaussian_filter_fft(sigmas, not_core):
+    data = np.random.random((6, 7, 9)).astype(np.float32)
+    truncate = 3.0
+    actual = _partial_charge._gaussian_filter_fft(data, sigmas, truncate)
+    expected = ndimage.gaussian_filter(
+        data.astype(np.float64), sigma=sigmas, truncate=truncate, mode="wrap"
+    )
+    assert actual.dtype == np.float32
+    assert np.allclose(actual, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("z_index", (0, 3, 9))
+def test_smooth_stm_slice(NonSplitPartialCharge, z_index, not_core):
+    settings = NonSplitPartialCharge.stm_settings
+    data = NonSplitPartialCharge.to_numpy().astype(np.float32)
+    actual = NonSplitPartialCharge._smooth_stm_slice(data, z_index, settings)
+    expected = NonSplitPartialCharge._smooth_stm_data(data, settings)[:, :, z_index]
+    assert actual.dtype == np.float32
+    assert np.allclose(actual, expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("mode", ("constant_height", "constant_current"))
+@pytest.mark.parametrize("sigma", ("sigma_xy", "sigma_z"))
+def test_to_stm_without_smoothing(NonSplitPartialCharge, mode, sigma, not_core):
+    settings = _partial_charge.STM_settings(**{sigma: 0.0})
+    first_index_above = _partial_charge._first_index_above
+    with patch.object(
+        _partial_charge, "_first_index_above", wraps=first_index_above
+    ) as mock_scan:
+        actual = NonSplitPartialCharge.to_stm(mode, stm_settings=settings)
+    assert np.all(np.isfinite(actual.series.data))
+    if mode == "constant_height":
+        assert np.any(actual.series.data != 0)
+    else:
+        # NaN charges would never reach the current and give a flat scan
+        smoothed_charge = mock_scan.call_args.args[0]
+        assert np.all(np.isfinite(smoothed_charge))
+
+
+def test_gaussian_kernel_without_width(not_core):
+    kernel = _partial_charge._gaussian_kernel(0.0, 3.0)
+    assert np.array_equal(kernel, [1.0])
+
+
+def test_gaussian_kernel_is_cached(not_core):
+    kernel = _partial_charge._gaussian_kernel(2.0, 3.0)
+    assert _partial_charge._gaussian_kernel(2.0, 3.0) is kernel
+    assert not kernel.flags.writeable
+    assert np.isclose(kernel.sum(), 1)
+
+
+def test_gaussian_response_is_cached(not_core):
+    response = _partial_charge._gaussian_response(2.0, 3.0, 10, True)
+    assert _partial_charge._gaussian_response(2.0, 3.0, 10, True) is response
+    assert not response.flags.writeable
+    assert response.shape == (6,)
+    assert np.isclose(response[0], 1)
+
+
+def test_first_index_above_linear(Assert, not_core):
+    num_z = 20
+    interpolation_factor = 10
+    data = np.random.random((5, 4, num_z))
+    data[0, 0] = 0  # never reaches the threshold
+    threshold = 0.9
+    actual = _partial_charge._first_index_above(
+        data, threshold, interpolation_factor, interpolation_order=1
+    )
+    z_grid = num_z - np.arange(num_z * interpolation_factor) / interpolation_factor
+    interpolated = np.apply_along_axis(
+        lambda column: np.interp(z_grid, range(num_z), column, period=num_z), -1, data
+    )
+    expected = np.argmax(interpolated >= threshold, axis=-1)
+    Assert.allclose(actual, expected)
+
+
+def test_first_index_above_cubic(Assert, not_core):
+    num_z = 20
+    interpolation_factor = 10
+    data = np.random.random((5, 4, num_z))
+    data[0, 0] = 0  # never reaches the threshold
+    threshold = 0.9
+    actual = _partial_charge._first_index_above(
+        data, threshold, interpolation_factor, interpolation_order=3
+    )
+    # compare to periodic cubic Hermite spline with central differences
+    derivatives = 0.5 * (np.roll(data, -1, axis=-1) - np.roll(data, 1, axis=-1))
+    wrap = lambda array: np.concatenate((array, array[..., :1]), axis=-1)
+    splines = interpolate.CubicHermiteSpline(
+        range(num_z + 1), wrap(data), wrap(derivatives), axis=-1
+    )
+    z_grid = num_z - np.arange(num_z * interpolation_factor) / interpolation_factor
+    expected = np.argmax(splines(z_grid) >= threshold, axis=-1)
+    Assert.allclose(actual, expected)
+
+
+def test_to_stm_incorrect_interpolation_order(NonSplitPartialCharge):
+    settings = _partial_charge.STM_settings(interpolation_order=2)
+    with pytest.raises(IncorrectUsage):
+        NonSplitPartialCharge.to_stm(stm_settings=settings)
+
+
+def test_z_index_in_vacuum(NonSplitPartialCharge, not_core):
+    lowest, highest = NonSplitPartialCharge._get_z_range()
+    c = NonSplitPartialCharge._out_of_plane_vector()
+    num_z = NonSplitPartialCharge.grid()[2]
+    settings = NonSplitPartialCharge.stm_settings
+    actual = NonSplitPartialCharge._z_index_in_vacuum(None, settings)
+    assert 0 <= actual < num_z
+    # the index is in the vacuum, i.e., above the slab or below it
+    height = actual * c / num_z
+    assert height > highest or height < lowest
+
+
+def test_z_index_in_vacuum_from_charge(NonSplitPartialCharge, not_core):
+    settings = _partial_charge.STM_settings(vacuum_from_structure=False)
+    smoothed_charge = np.ones(NonSplitPartialCharge.grid()[::-1])
+    smoothed_charge[:, :, 3] = 0
+    actual = NonSplitPartialCharge._z_index_in_vacuum(smoothed_charge, settings)
+    assert actual == 3
+
+
+def test_to_stm_vacuum_from_charge(PolarizedNonSplitPartialCharge, not_core):
+    settings = _partial_charge.STM_settings(vacuum_from_structure=False)
+    with patch.object(
+        _partial_charge, "_min_of_z_charge", wraps=_partial_charge._min_of_z_charge
+    ) as mock_min:
+        actual = PolarizedNonSplitPartialCharge.to_stm("cc", stm_settings=settings)
+    mock_min.assert_called_once()
+    assert "constant current" in actual.title
+
+
 def test_stm_default_settings(PolarizedNonSplitPartialCharge):
     actual = dataclasses.asdict(PolarizedNonSplitPartialCharge.stm_settings)
     defaults = {
@@ -319,6 +537,8 @@ def test_stm_default_settings(PolarizedNonSplitPartialCharge):
         "truncate": 3.0,
         "enhancement_factor": 1000,
         "interpolation_factor": 10,
+        "interpolation_order": 1,
+        "vacuum_from_structure": True,
     }
     assert actual == defaults
 
@@ -331,7 +331,7 @@ class RawDataFactory:
         return _partial_charge(selection)
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def raw_data():
     return RawDataFactory
 
@@ -496,16 +496,14 @@ def _line_kpoints(mode, labels):
     Y = [0.5, 0.5, 0.0]
     A = [0, 0, 0.5]
     M = [0.5, 0.5, 0.5]
-    coordinates = (
-        np.linspace(GM, A, line_length),
-        np.linspace(A, M, line_length),
-        np.linspace(GM, Y, line_length),
-        np.linspace(Y, M, line_length),
-    )
+    starts = np.array((GM, A, GM, Y))
+    ends = np.array((A, M, Y, M))
+    # sample all lines at once, the points of each line follow the line index
+    coordinates = np.linspace(starts, ends, line_length, axis=1)
     kpoints = raw.Kpoint(
         mode=mode,
         number=line_length,
-        coordinates=np.concatenate(coordinates),
+        coordinates=coordinates.reshape(-1, 3),
         weights=np.ones(len(coordinates)),
         cell=_Sr2TiO4_cell(),
     )
@@ -552,14 +550,14 @@ def _single_band(projectors):
     return raw.Band(
         dispersion=dispersion,
         fermi_energy=0.0,
-        occupations=np.array([np.linspace([1], [0], dispersion.eigenvalues.size)]),
+        occupations=np.linspace(1, 0, dispersion.eigenvalues.size).reshape(1, -1, 1),
         projectors=_Sr2TiO4_projectors(use_orbitals=False),
     )
 
 
 def _single_band_dispersion():
     kpoints = _grid_kpoints("explicit", "no_labels")
-    eigenvalues = np.array([np.linspace([0], [1], len(kpoints.coordinates))])
+    eigenvalues = np.linspace(0, 1, len(kpoints.coordinates)).reshape(1, -1, 1)
     return raw.Dispersion(kpoints, eigenvalues)
 
 